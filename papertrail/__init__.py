@@ -1,3 +1,4 @@
 __version__ = '0.1.0'
 
 from papertrail.models import log, search
+from papertrail.live import tail
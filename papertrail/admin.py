@@ -8,7 +8,7 @@ from django.utils.text import capfirst
 from django.utils.translation import ugettext as _
 
 import papertrail
-from papertrail.models import Entry
+from papertrail.models import Entry, prefetch_targets
 
 
 class AdminEventLoggerMixin(object):
@@ -176,7 +176,9 @@ def view_papertrail_action(template=None, extra_context=None, use_related_field=
         if use_related_field:
             queryset = _map_to_related_queryset(queryset, use_related_field)
         
-        action_list = Entry.objects.related_to(queryset).select_related()
+        # Load every target and related object on the page in bulk, rather
+        # than once per row while rendering
+        action_list = prefetch_targets(Entry.objects.related_to(queryset))
         opts = queryset.model._meta
         app_label = opts.app_label
 
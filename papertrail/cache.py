@@ -0,0 +1,220 @@
+'''
+Read-through cache for per-object papertrail timelines.
+
+Objects that are looked up on nearly every page view (large accounts, shared
+groups, etc.) would otherwise repeat the same `related_to(obj)` query over and
+over.  Timelines are cached in two layers: a small in-process LRU in front of
+Django's cache framework.  Each object has a 'generation' counter stored in the
+shared cache; writes that touch the object (`log()`, `Entry.set()` and
+`replace_object_in_papertrail()`) bump the generation, which invalidates every
+cached timeline for that object in every process at once.
+
+That only holds if the cache backend is shared between processes, such as
+memcached or redis.  With a per-process backend like the default
+LocMemCache, writes in one process don't invalidate timelines cached by
+another.  With DummyCache, timelines are never cached.
+
+Settings:
+
+    PAPERTRAIL_TIMELINE_CACHE_TIMEOUT   seconds to keep shared entries (300)
+    PAPERTRAIL_TIMELINE_PAGE_SIZE       entries in a cached first page (25)
+    PAPERTRAIL_TIMELINE_LRU_SIZE        entries in the in-process LRU (256)
+'''
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.db.models import Count
+
+
+KEY_PREFIX = 'papertrail:timeline'
+
+
+def _setting(name, default):
+    return getattr(settings, 'PAPERTRAIL_TIMELINE_{0}'.format(name), default)
+
+
+class LRUCache(object):
+    '''
+    A minimal thread-safe LRU mapping used as the in-process layer.
+    '''
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                return default
+            self._data[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class TimelineCacheStats(object):
+    '''
+    Hit/miss counters for the timeline cache in the current process.
+    '''
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.local_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def incr(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    @property
+    def hits(self):
+        return self.local_hits + self.shared_hits
+
+    def as_dict(self):
+        return {
+            'local_hits': self.local_hits,
+            'shared_hits': self.shared_hits,
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            }
+
+
+_local = LRUCache(_setting('LRU_SIZE', 256))
+stats = TimelineCacheStats()
+
+
+def _object_key(obj_or_pair):
+    '''
+    Normalize a model instance or a (content_type, id) pair, as accepted by
+    `Entry.set()`, to a (content_type_id, object_id) pair.
+    '''
+    if isinstance(obj_or_pair, tuple):
+        content_type, object_id = obj_or_pair
+        content_type_id = getattr(content_type, 'pk', content_type)
+    else:
+        content_type_id = ContentType.objects.get_for_model(obj_or_pair.__class__).pk
+        object_id = obj_or_pair.pk
+    return int(content_type_id), int(object_id)
+
+
+def _generation_key(content_type_id, object_id):
+    return '{0}:gen:{1}:{2}'.format(KEY_PREFIX, content_type_id, object_id)
+
+
+def _new_generation():
+    # Seeding from the clock means that a generation counter evicted from the
+    # shared cache never comes back at a value that older entries were stored
+    # under.
+    return int(time.time() * 1000)
+
+
+def _generation(content_type_id, object_id):
+    key = _generation_key(content_type_id, object_id)
+    generation = cache.get(key)
+    if generation is None:
+        cache.add(key, _new_generation())
+        generation = cache.get(key)
+    return generation
+
+
+def invalidate(*objs):
+    '''
+    Invalidate cached timelines for each of `objs`, which may be model
+    instances or (content_type, id) pairs.
+    '''
+    for obj in objs:
+        if obj is None:
+            continue
+        key = _generation_key(*_object_key(obj))
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _new_generation())
+        stats.incr('invalidations')
+
+
+def _cached(obj, kind, compute):
+    content_type_id, object_id = _object_key(obj)
+    generation = _generation(content_type_id, object_id)
+    if generation is None:
+        # The cache backend didn't keep the generation (e.g. DummyCache), so
+        # nothing cached could ever be invalidated
+        stats.incr('misses')
+        return compute()
+
+    key = '{0}:{1}:{2}:{3}:{4}'.format(
+        KEY_PREFIX, kind, content_type_id, object_id, generation)
+
+    value = _local.get(key)
+    if value is not None:
+        stats.incr('local_hits')
+        return value
+
+    value = cache.get(key)
+    if value is not None:
+        stats.incr('shared_hits')
+    else:
+        stats.incr('misses')
+        value = compute()
+        cache.set(key, value, _setting('CACHE_TIMEOUT', 300))
+    _local.set(key, value)
+    return value
+
+
+def timeline(obj):
+    '''
+    Return the first page of entries related to `obj`, newest first, as a
+    list of `Entry` objects.
+    '''
+    from papertrail.models import Entry
+
+    page_size = _setting('PAGE_SIZE', 25)
+    return _cached(obj, 'page', lambda: list(
+        Entry.objects.related_to(obj)[:page_size]))
+
+
+def type_counts(obj):
+    '''
+    Return a dict mapping event type to the number of entries of that type
+    related to `obj`.
+    '''
+    from papertrail.models import Entry, related_to
+
+    def compute():
+        rows = (Entry.objects.filter(related_to(obj))
+                             .order_by()
+                             .values('type')
+                             .annotate(count=Count('id', distinct=True)))
+        return dict((row['type'], row['count']) for row in rows)
+
+    return _cached(obj, 'counts', compute)
+
+
+def clear_local():
+    '''
+    Drop everything held in the in-process layer.
+    '''
+    _local.clear()
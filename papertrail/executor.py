@@ -0,0 +1,178 @@
+'''
+Non-blocking papertrail calls for services running an event loop.
+
+Calls are run on a dedicated, bounded thread pool rather than an event loop's
+default executor, so papertrail traffic can't starve other blocking work.
+Each function returns a `concurrent.futures.Future`, which event loops can
+wait on directly (e.g. with tornado's `yield`, or trollius/asyncio's
+`wrap_future()`).  `log_async()` calls `log()`, so `event_logged` and
+external_key deduplication behave exactly as they do synchronously.
+
+Requires `concurrent.futures` (the `futures` backport on Python 2).
+
+Settings:
+
+    PAPERTRAIL_EXECUTOR_WORKERS       worker threads (4)
+    PAPERTRAIL_EXECUTOR_MAX_PENDING   queued calls before submitting fails (1000)
+'''
+import inspect
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections, transaction
+
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:
+    ThreadPoolExecutor = None
+
+from papertrail.models import _create_entry, _entry_logged, log, search
+
+
+_executor = None
+_pending = None
+_executor_lock = threading.Lock()
+
+# Connections opened by worker threads, closed on shutdown
+_worker_connections = []
+_worker_connections_lock = threading.Lock()
+_worker_state = threading.local()
+
+
+class ExecutorFull(Exception):
+    '''
+    Raised when submitting a call while too many calls are already pending.
+    '''
+
+
+def _get_executor():
+    global _executor, _pending
+    if ThreadPoolExecutor is None:
+        raise ImproperlyConfigured(
+            'papertrail.executor requires concurrent.futures; '
+            'install the "futures" package')
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                getattr(settings, 'PAPERTRAIL_EXECUTOR_WORKERS', 4))
+            _pending = threading.BoundedSemaphore(
+                getattr(settings, 'PAPERTRAIL_EXECUTOR_MAX_PENDING', 1000))
+    return _executor, _pending
+
+
+def _run(fn, *args, **kwargs):
+    # Worker threads keep their connections between calls.  Each call ends
+    # its transaction so that idle workers don't hold one open, and a call
+    # that fails drops the connections in case they were left unusable.
+    if not getattr(_worker_state, 'registered', False):
+        _worker_state.registered = True
+        with _worker_connections_lock:
+            _worker_connections.extend(connections.all())
+    try:
+        result = fn(*args, **kwargs)
+    except:
+        for connection in connections.all():
+            connection.close()
+        raise
+    for connection in connections.all():
+        connection.commit_unless_managed()
+    return result
+
+
+def submit(fn, *args, **kwargs):
+    '''
+    Run `fn(*args, **kwargs)` on the papertrail executor, returning a Future.
+    Raises `ExecutorFull` rather than blocking if the maximum number of calls
+    are already pending, so callers on an event loop can apply backpressure
+    themselves.
+    '''
+    executor, pending = _get_executor()
+    if not pending.acquire(False):
+        raise ExecutorFull('Too many papertrail calls are pending')
+    try:
+        future = executor.submit(_run, fn, *args, **kwargs)
+    except:
+        pending.release()
+        raise
+    future.add_done_callback(lambda f: pending.release())
+    return future
+
+
+def log_async(*args, **kwargs):
+    '''
+    Non-blocking `log()`.  The Future's result is the logged entry, or None if
+    an entry with the same external_key already existed.
+    '''
+    return submit(log, *args, **kwargs)
+
+
+def _log_many(events):
+    calls = [(event.get('args', ()), event.get('kwargs', {}))
+             for event in events]
+    # A single transaction, so that the batch is logged all or nothing
+    with transaction.commit_on_success():
+        entries = [_create_entry(*args, **kwargs) for args, kwargs in calls]
+    for entry, (args, kwargs) in zip(entries, calls):
+        if entry is not None:
+            targets = inspect.getcallargs(_create_entry, *args, **kwargs)['targets']
+            _entry_logged(entry, targets)
+    return entries
+
+
+def log_many_async(events):
+    '''
+    Log a list of events in a single executor call and transaction.  Each
+    event is a dict of `args` and `kwargs` for `log()`.  The Future's result
+    is the list of logged entries, in order.  If any event fails, none of
+    them are logged, and `event_logged` is only sent once all of them are.
+
+    Example:
+
+        log_many_async([
+            {'args': ('user-login', 'User logged in'), 'kwargs': {'targets': {'user': user}}},
+            {'args': ('user-logout', 'User logged out'), 'kwargs': {'targets': {'user': user}}},
+            ])
+    '''
+    return submit(_log_many, list(events))
+
+
+def _evaluate(qs):
+    return list(qs)
+
+
+def evaluate_async(qs):
+    '''
+    Evaluate a queryset (e.g. an `EntryQuerySet`, or `qs.as_rows()`) on the
+    executor.  The Future's result is the list of results.
+    '''
+    return submit(_evaluate, qs)
+
+
+def search_async(*args, **kwargs):
+    '''
+    Non-blocking `search()`.  The Future's result is the list of matching
+    entries.
+    '''
+    return evaluate_async(search(*args, **kwargs))
+
+
+def shutdown(wait=True):
+    '''
+    Shut down the executor; it is started again on the next call.  With
+    `wait`, pending calls are finished and worker connections closed.
+    '''
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            return
+        _executor.shutdown(wait=wait)
+        _executor = None
+        if wait:
+            # The worker threads have exited, so their connections can be
+            # closed from here
+            with _worker_connections_lock:
+                for connection in _worker_connections:
+                    connection.allow_thread_sharing = True
+                    connection.close()
+                del _worker_connections[:]
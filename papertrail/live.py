@@ -0,0 +1,110 @@
+'''
+Tailing the papertrail for newly logged entries.
+
+Readers keep an id high-water mark (the 'cursor') and only ever fetch entries
+logged after it.  Waiting readers are woken by `event_logged` as soon as an
+entry is logged in the same process, and fall back to polling every
+`poll_interval` seconds for entries logged elsewhere.
+
+Note that ids are allocated when rows are inserted, not when they commit, so
+an entry from a long-running transaction can commit behind the cursor.
+'''
+import threading
+import time
+
+from django.db.models import Max
+from django.dispatch import receiver
+
+from papertrail import signals
+from papertrail.models import Entry, prefetch_targets
+
+
+_logged = threading.Condition()
+_logged_count = [0]
+
+
+@receiver(signals.event_logged)
+def _wake_waiting_readers(sender, **kwargs):
+    with _logged:
+        _logged_count[0] += 1
+        _logged.notify_all()
+
+
+def current_cursor():
+    '''
+    Return the cursor at the head of the papertrail, i.e. the id of the most
+    recently logged entry (or 0 if there are none).
+    '''
+    return Entry.objects.aggregate(max_id=Max('id'))['max_id'] or 0
+
+
+def new_entries(cursor, filters=None, limit=100):
+    '''
+    Return up to `limit` entries logged after `cursor`, oldest first, with
+    their targets already resolved.  `filters` is a dict of lookups for
+    `Entry.objects.filter()`.
+    '''
+    qs = (Entry.objects.filter(id__gt=cursor, **(filters or {}))
+                       .order_by('id'))
+    return prefetch_targets(qs[:limit])
+
+
+def _wait_for_log(seen_count, timeout):
+    '''
+    Block until an entry is logged in this process after `seen_count` entries
+    were observed, or until `timeout` seconds pass.
+    '''
+    with _logged:
+        if _logged_count[0] == seen_count:
+            _logged.wait(timeout)
+
+
+def wait_for_new_entries(cursor, filters=None, limit=100, timeout=None,
+                         poll_interval=5):
+    '''
+    Like `new_entries()`, but if there are none yet, wait for up to `timeout`
+    seconds (forever if None) for some to be logged.  Returns an empty list
+    if none arrive in time.
+    '''
+    deadline = time.time() + timeout if timeout is not None else None
+    while True:
+        seen_count = _logged_count[0]
+        entries = new_entries(cursor, filters, limit=limit)
+        if entries:
+            return entries
+
+        wait = poll_interval
+        if deadline is not None:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return entries
+            wait = min(wait, remaining)
+        _wait_for_log(seen_count, wait)
+
+
+def tail(since_cursor=None, filters=None, batch_size=100, poll_interval=5,
+         timeout=None):
+    '''
+    Generate entries as they are logged, oldest first.
+
+    `since_cursor` is the id of the last entry already seen; entries logged
+    after it are generated.  If it is None, only entries logged from now on
+    are generated.  `filters` is a dict of lookups for `Entry.objects.filter()`.
+    The generator finishes once no new entries have arrived for `timeout`
+    seconds, or never if `timeout` is None.
+
+    Example:
+
+        for entry in papertrail.tail(filters={'type__startswith': 'billing-'}):
+            print entry.id, entry.message, entry.targets_map
+    '''
+    cursor = current_cursor() if since_cursor is None else since_cursor
+    while True:
+        entries = wait_for_new_entries(cursor, filters, limit=batch_size,
+                                       timeout=timeout,
+                                       poll_interval=poll_interval)
+        if not entries:
+            return
+        for entry in entries:
+            cursor = entry.id
+            yield entry
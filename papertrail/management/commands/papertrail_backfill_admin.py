@@ -0,0 +1,241 @@
+import json
+import multiprocessing
+import os
+import re
+import time
+from datetime import timedelta
+from optparse import make_option
+
+from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.db.models import Max, Min
+
+from papertrail import cache
+from papertrail.models import Entry, EntryRelatedObject, insert_entry_or_ignore
+
+
+ACTIONS = {
+    ADDITION: ('add', 'Created object'),
+    CHANGE: ('change', 'Updated object'),
+    DELETION: ('delete', 'Deleted object'),
+    }
+
+# Longest expected gap between the LogEntry written by AdminEventLoggerMixin
+# and its own admin-edit entry
+MIXIN_LOG_TOLERANCE = timedelta(seconds=1)
+
+# Matches the plain-text messages built by Django's default
+# ModelAdmin.construct_change_message(), e.g. 'Changed name and email.'
+CHANGED_FIELDS_RE = re.compile(r'^Changed (.+?)\.(?: |$)')
+
+
+def external_key_for(log_entry_id):
+    return 'admin-logentry:{0}'.format(log_entry_id)
+
+
+def parse_change_message(message):
+    '''
+    Convert a LogEntry change message to event data.  Messages written by
+    `AdminEventLoggerMixin` are JSON and are stored the same way the mixin
+    stores them; Django's plain-text messages are kept as-is, along with the
+    list of changed fields where it can be recovered.
+    '''
+    try:
+        return {'changes': json.loads(message)}
+    except ValueError:
+        pass
+
+    data = {'message': message}
+    match = CHANGED_FIELDS_RE.match(message or '')
+    if match:
+        fields = re.split(r', | and ', match.group(1))
+        data['fields'] = [f for f in fields if f]
+    return data
+
+
+def _close_connections():
+    for connection in connections.all():
+        connection.close()
+
+
+def backfill_range(id_range):
+    '''
+    Convert the LogEntry rows with ids in [start, end) to 'admin-edit' entries.
+    Rows that were already converted are skipped via their external_key.
+    Returns a tuple of (start, end, rows scanned, entries created).
+    '''
+    start, end = id_range
+    # LogEntry.user points at the configured user model, which may not be
+    # django.contrib.auth's User
+    user_model = LogEntry._meta.get_field('user').rel.to
+    user_type_id = ContentType.objects.get_for_model(user_model).pk
+    rows = (LogEntry.objects.filter(id__gte=start, id__lt=end)
+                            .order_by('id')
+                            .values_list('id', 'action_time', 'user_id',
+                                         'content_type_id', 'object_id',
+                                         'object_repr', 'action_flag',
+                                         'change_message'))
+    scanned = created = 0
+    touched = set()
+
+    with transaction.commit_on_success():
+        targets = []
+        for (log_id, action_time, user_id, content_type_id, object_id,
+             object_repr, action_flag, change_message) in rows:
+            scanned += 1
+            action, message = ACTIONS.get(action_flag, ('change', 'Updated object'))
+            data = {'action': action, 'object_repr': object_repr}
+            if action == 'change':
+                data.update(parse_change_message(change_message))
+
+            relations = [('acting_user', user_type_id, user_id)]
+            # Targets can only reference objects with integer primary keys
+            if content_type_id and object_id and object_id.isdigit():
+                relations.append(('instance', content_type_id, int(object_id)))
+            else:
+                data['object_id'] = object_id
+
+            entry, is_new = insert_entry_or_ignore(
+                'admin-edit', message,
+                data=data,
+                timestamp=action_time,
+                external_key=external_key_for(log_id),
+                )
+            if not is_new:
+                continue
+            created += 1
+
+            for relation_name, related_type_id, related_id in relations:
+                targets.append(EntryRelatedObject(
+                    entry=entry,
+                    relation_name=relation_name,
+                    related_content_type_id=related_type_id,
+                    related_id=related_id,
+                    ))
+                touched.add((related_type_id, related_id))
+
+        EntryRelatedObject.objects.bulk_create(targets)
+
+    cache.invalidate(*touched)
+    return start, end, scanned, created
+
+
+class Command(BaseCommand):
+    help = ('Backfill papertrail with admin-edit entries converted from '
+            'Django admin LogEntry history.')
+    option_list = BaseCommand.option_list + (
+        make_option('--processes', type='int', dest='processes',
+                    default=multiprocessing.cpu_count(),
+                    help='Number of worker processes (1 runs in-process).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of LogEntry ids converted per batch.'),
+        make_option('--checkpoint', dest='checkpoint', default=None,
+                    help='File recording the last converted LogEntry id, used '
+                         'to resume an interrupted backfill.'),
+        make_option('--max-id', type='int', dest='max_id', default=None,
+                    help='Only convert LogEntry rows up to this id.  By '
+                         'default, conversion stops before the first '
+                         'admin-edit entry logged by AdminEventLoggerMixin.'),
+        make_option('--all', action='store_true', dest='all', default=False,
+                    help='Convert every LogEntry row, even ones recorded '
+                         'after AdminEventLoggerMixin was adopted.'),
+        )
+
+    def handle(self, *args, **options):
+        processes = options['processes']
+        batch_size = options['batch_size']
+        checkpoint = options['checkpoint']
+        if processes < 1 or batch_size < 1:
+            raise CommandError('--processes and --batch-size must be positive')
+
+        max_id = options['max_id']
+        if max_id is None and not options['all']:
+            max_id = self._last_id_before_mixin()
+            if max_id is not None:
+                self.stdout.write(
+                    'Stopping at LogEntry {0}, before the first admin-edit '
+                    'entry logged by AdminEventLoggerMixin (use --all to '
+                    'convert everything).\n'.format(max_id))
+
+        resume_from = self._read_checkpoint(checkpoint)
+        log_entries = LogEntry.objects.filter(id__gt=resume_from)
+        if max_id is not None:
+            log_entries = log_entries.filter(id__lte=max_id)
+        bounds = log_entries.aggregate(min_id=Min('id'), max_id=Max('id'))
+        if bounds['min_id'] is None:
+            self.stdout.write('Nothing to backfill.\n')
+            return
+
+        ranges = [(start, min(start + batch_size, bounds['max_id'] + 1))
+                  for start in xrange(bounds['min_id'], bounds['max_id'] + 1, batch_size)]
+
+        started = time.time()
+        total_scanned = total_created = 0
+        if processes == 1:
+            pool = None
+            results = (backfill_range(r) for r in ranges)
+        else:
+            # Worker processes must not share the parent's connections
+            _close_connections()
+            pool = multiprocessing.Pool(processes, initializer=_close_connections)
+            results = pool.imap(backfill_range, ranges)
+
+        try:
+            # Results arrive in id order, so everything up to the end of each
+            # finished range is done and can be checkpointed.
+            for start, end, scanned, created in results:
+                total_scanned += scanned
+                total_created += created
+                self._write_checkpoint(checkpoint, end - 1)
+                elapsed = time.time() - started
+                self.stdout.write(
+                    'Converted ids {0}-{1}: {2} rows, {3} new entries '
+                    '({4:.0f} rows/s)\n'.format(
+                        start, end - 1, scanned, created,
+                        total_scanned / elapsed if elapsed else 0))
+        finally:
+            if pool:
+                pool.terminate()
+                pool.join()
+
+        elapsed = time.time() - started
+        self.stdout.write(
+            'Backfilled {0} LogEntry rows ({1} new entries) in {2:.1f}s, '
+            '{3:.0f} rows/s\n'.format(
+                total_scanned, total_created, elapsed,
+                total_scanned / elapsed if elapsed else 0))
+
+    def _last_id_before_mixin(self):
+        '''
+        Return the id of the last LogEntry recorded before the first
+        admin-edit entry logged by AdminEventLoggerMixin (which, unlike
+        backfilled entries, has no external_key), or None if there is none.
+        Those later rows already have entries, so converting them would log
+        each edit twice.
+        '''
+        first_logged = (Entry.objects.filter(type='admin-edit',
+                                             external_key__isnull=True)
+                                     .aggregate(first=Min('timestamp'))['first'])
+        if first_logged is None:
+            return None
+        # The mixin writes the LogEntry just before its own entry, so allow
+        # for the gap between their timestamps
+        cutoff = first_logged - MIXIN_LOG_TOLERANCE
+        return (LogEntry.objects.filter(action_time__lt=cutoff)
+                                .aggregate(last=Max('id'))['last']) or 0
+
+    def _read_checkpoint(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        with open(path) as f:
+            return json.load(f)['last_id']
+
+    def _write_checkpoint(self, path, last_id):
+        if not path:
+            return
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'last_id': last_id}, f)
+        os.rename(tmp_path, path)
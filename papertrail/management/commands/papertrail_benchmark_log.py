@@ -0,0 +1,97 @@
+import time
+from collections import deque
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from papertrail import executor
+from papertrail.models import Entry, log
+
+
+BENCHMARK_TYPE = 'papertrail-benchmark'
+
+
+def _submit_all(calls):
+    '''
+    Submit each (fn, args, kwargs) call to the executor, waiting for the
+    oldest pending call to finish whenever it's full, then wait for all of
+    them.
+    '''
+    futures = deque()
+    for fn, args, kwargs in calls:
+        while True:
+            try:
+                futures.append(fn(*args, **kwargs))
+                break
+            except executor.ExecutorFull:
+                futures.popleft().result()
+    for future in futures:
+        future.result()
+
+
+class Command(BaseCommand):
+    help = ('Compare the throughput of log() with executor.log_async() and '
+            'executor.log_many_async().  Entries are logged with the type '
+            '"{0}" and deleted afterwards.'.format(BENCHMARK_TYPE))
+    option_list = BaseCommand.option_list + (
+        make_option('--entries', type='int', dest='entries', default=1000,
+                    help='Number of entries logged by each method.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=100,
+                    help='Number of entries per log_many_async() call.'),
+        make_option('--external-keys', action='store_true', dest='external_keys',
+                    default=False,
+                    help='Log entries with external keys.'),
+        )
+
+    def handle(self, *args, **options):
+        if executor.ThreadPoolExecutor is None:
+            raise CommandError('The executor requires concurrent.futures; '
+                               'install the "futures" package')
+        num_entries = options['entries']
+        batch_size = options['batch_size']
+        if num_entries < 1 or batch_size < 1:
+            raise CommandError('--entries and --batch-size must be positive')
+
+        run = [0]
+
+        def events():
+            run[0] += 1
+            for i in xrange(num_entries):
+                kwargs = {'data': {'i': i}}
+                if options['external_keys']:
+                    kwargs['external_key'] = '{0}-{1}'.format(run[0], i)
+                yield (BENCHMARK_TYPE, 'Benchmark entry'), kwargs
+
+        def bench_log():
+            for args, kwargs in events():
+                log(*args, **kwargs)
+
+        def bench_log_async():
+            _submit_all((executor.log_async, args, kwargs)
+                        for args, kwargs in events())
+
+        def bench_log_many_async():
+            batch = []
+            batches = []
+            for args, kwargs in events():
+                batch.append({'args': args, 'kwargs': kwargs})
+                if len(batch) == batch_size:
+                    batches.append(batch)
+                    batch = []
+            if batch:
+                batches.append(batch)
+            _submit_all((executor.log_many_async, (b,), {}) for b in batches)
+
+        try:
+            for name, bench in (('log', bench_log),
+                                ('log_async', bench_log_async),
+                                ('log_many_async', bench_log_many_async)):
+                started = time.time()
+                bench()
+                elapsed = time.time() - started
+                self.stdout.write('{0:<16} {1} entries in {2:.2f}s, {3:.0f} entries/s\n'.format(
+                    name, num_entries, elapsed,
+                    num_entries / elapsed if elapsed else 0))
+        finally:
+            executor.shutdown()
+            Entry.objects.filter(type=BENCHMARK_TYPE).delete()
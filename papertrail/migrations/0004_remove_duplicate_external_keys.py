@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        # Entries logged concurrently with the same external_key could be
+        # inserted twice before the next migration added a unique constraint.
+        # Keep the first entry for each (type, external_key) and delete the
+        # others along with their targets.
+        duplicates = (orm['papertrail.Entry'].objects
+                      .filter(external_key__isnull=False)
+                      .order_by()
+                      .values('type', 'external_key')
+                      .annotate(num_entries=models.Count('id'),
+                                first_id=models.Min('id'))
+                      .filter(num_entries__gt=1))
+        for duplicate in duplicates:
+            entry_ids = list(orm['papertrail.Entry'].objects
+                             .filter(type=duplicate['type'],
+                                     external_key=duplicate['external_key'])
+                             .exclude(id=duplicate['first_id'])
+                             .values_list('id', flat=True))
+            orm['papertrail.EntryRelatedObject'].objects.filter(entry__in=entry_ids).delete()
+            orm['papertrail.Entry'].objects.filter(id__in=entry_ids).delete()
+
+    def backwards(self, orm):
+        # Deleted duplicates can't be restored
+        pass
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'papertrail.entry': {
+            'Meta': {'ordering': "['-timestamp']", 'object_name': 'Entry'},
+            'data': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'external_key': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'papertrail.entryrelatedobject': {
+            'Meta': {'object_name': 'EntryRelatedObject'},
+            'entry': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'targets'", 'to': "orm['papertrail.Entry']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'related_content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'related_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'relation_name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['papertrail']
\ No newline at end of file
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.db import models
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding unique constraint on 'Entry', fields ['type', 'external_key']
+        db.create_unique('papertrail_entry', ['type', 'external_key'])
+
+
+    def backwards(self, orm):
+        # Removing unique constraint on 'Entry', fields ['type', 'external_key']
+        db.delete_unique('papertrail_entry', ['type', 'external_key'])
+
+
+    models = {
+        'contenttypes.contenttype': {
+            'Meta': {'ordering': "('name',)", 'unique_together': "(('app_label', 'model'),)", 'object_name': 'ContentType', 'db_table': "'django_content_type'"},
+            'app_label': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'model': ('django.db.models.fields.CharField', [], {'max_length': '100'}),
+            'name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        },
+        'papertrail.entry': {
+            'Meta': {'ordering': "['-timestamp']", 'unique_together': "(('type', 'external_key'),)", 'object_name': 'Entry'},
+            'data': ('jsonfield.fields.JSONField', [], {'null': 'True'}),
+            'external_key': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True'}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'message': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'timestamp': ('django.db.models.fields.DateTimeField', [], {}),
+            'type': ('django.db.models.fields.CharField', [], {'max_length': '50'})
+        },
+        'papertrail.entryrelatedobject': {
+            'Meta': {'object_name': 'EntryRelatedObject'},
+            'entry': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "'targets'", 'to': "orm['papertrail.Entry']"}),
+            'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'related_content_type': ('django.db.models.fields.related.ForeignKey', [], {'to': "orm['contenttypes.ContentType']"}),
+            'related_id': ('django.db.models.fields.PositiveIntegerField', [], {}),
+            'relation_name': ('django.db.models.fields.CharField', [], {'max_length': '100'})
+        }
+    }
+
+    complete_apps = ['papertrail']
\ No newline at end of file
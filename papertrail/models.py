@@ -1,11 +1,13 @@
 import types
-from django.db import models, transaction
+from itertools import islice
+from django.db import connections, models, router, transaction, IntegrityError
+from django.db.models.query import prefetch_related_objects
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes import generic
 from django.utils import timezone
 from django.conf import settings
 import jsonfield
-from papertrail import signals
+from papertrail import cache, signals
 
 def coerce_to_queryset(instance_or_queryset):
     if isinstance(instance_or_queryset, models.Model):
@@ -85,6 +87,58 @@ class EntryQuerySet(models.query.QuerySet):
 
         return entry_qs.distinct('timestamp', 'id')
 
+    def as_rows(self, data=False, resolve=False, chunk_size=2000):
+        '''
+        Iterate over the entries as lightweight read-only `EntryRow`s instead
+        of model instances, for listing and reporting over many entries.
+        Rows are read with `values_list()` in chunks of `chunk_size`, and each
+        chunk's targets are read with a single query as (relation_name,
+        content_type_id, related_id) tuples.
+
+        `data` includes the raw `data` column value.  Target objects are only
+        loaded on access to a row's `targets_map`; pass `resolve=True` to load
+        them up front, in bulk for each chunk.
+
+        Example:
+
+            for row in Entry.objects.filter(type='signup').as_rows():
+                writer.writerow([row.id, row.timestamp, row.message])
+        '''
+        if chunk_size < 1:
+            raise ValueError('chunk_size must be positive')
+        return self._iter_rows(data, resolve, chunk_size)
+
+    def _iter_rows(self, data, resolve, chunk_size):
+        fields = ['id', 'timestamp', 'type', 'message']
+        if data:
+            fields.append('data')
+        values = self.values_list(*fields).iterator()
+
+        while True:
+            chunk = list(islice(values, chunk_size))
+            if not chunk:
+                return
+
+            targets = {}
+            target_values = (EntryRelatedObject.objects
+                             .filter(entry__in=[v[0] for v in chunk])
+                             .order_by()
+                             .values_list('entry', 'relation_name',
+                                          'related_content_type', 'related_id'))
+            for entry_id, relation_name, content_type_id, related_id in target_values:
+                targets.setdefault(entry_id, []).append(
+                    (relation_name, content_type_id, related_id))
+
+            rows = [EntryRow(*v, targets=tuple(targets.get(v[0], ())))
+                    for v in chunk]
+            if resolve:
+                resolved = resolve_targets(
+                    (t[1], t[2]) for row in rows for t in row.targets)
+                for row in rows:
+                    row.resolve(resolved)
+            for row in rows:
+                yield row
+
 
 class EntryManager(models.Manager):
 
@@ -115,6 +169,7 @@ class Entry(models.Model):
     class Meta:
         ordering = ['-timestamp']
         get_latest_by = 'timestamp'
+        unique_together = (('type', 'external_key'),)
 
     def get(self, target, default=None):
         try:
@@ -130,10 +185,13 @@ class Entry(models.Model):
         also be a tuple of (content_type, id) to reference an object as the
         contenttypes app does (this also allows references to deleted objects).
         '''
-        target = self.get(target_name)
+        targets = list(self.targets.filter(relation_name=target_name)[:1])
+        target = targets[0] if targets else None
         if target and not replace:
             raise ValueError('Target {} already exists for this event'.format(target_name))
 
+        if target:
+            cache.invalidate((target.related_content_type_id, target.related_id))
         target = target or EntryRelatedObject(entry=self, relation_name=target_name)
         if type(val) == types.TupleType:
             content_type, object_id = val
@@ -143,6 +201,8 @@ class Entry(models.Model):
         elif val:
             target.related_object = val
             target.save()
+        if val:
+            cache.invalidate(val)
         return target
 
     @property
@@ -168,6 +228,48 @@ class Entry(models.Model):
         return self.targets.filter(relation_name=target_name).count() != 0
 
 
+class EntryRow(object):
+    '''
+    A compact, read-only entry record produced by `EntryQuerySet.as_rows()`.
+    `targets` is a tuple of (relation_name, content_type_id, related_id).
+    '''
+    __slots__ = ('id', 'timestamp', 'type', 'message', 'data', 'targets',
+                 '_targets_map')
+
+    def __init__(self, id, timestamp, type, message, data=None, targets=()):
+        set_slot = object.__setattr__
+        set_slot(self, 'id', id)
+        set_slot(self, 'timestamp', timestamp)
+        set_slot(self, 'type', type)
+        set_slot(self, 'message', message)
+        set_slot(self, 'data', data)
+        set_slot(self, 'targets', targets)
+        set_slot(self, '_targets_map', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('EntryRow is read-only')
+
+    def resolve(self, resolved=None):
+        '''
+        Resolve targets to objects, optionally from a mapping of
+        (content_type_id, related_id) pairs to objects already loaded in bulk.
+        '''
+        if resolved is None:
+            resolved = resolve_targets((t[1], t[2]) for t in self.targets)
+        object.__setattr__(self, '_targets_map', dict(
+            (relation_name, resolved.get((content_type_id, related_id)))
+            for relation_name, content_type_id, related_id in self.targets))
+
+    @property
+    def targets_map(self):
+        if self._targets_map is None:
+            self.resolve()
+        return self._targets_map
+
+    def __repr__(self):
+        return '<EntryRow {0}: {1}>'.format(self.id, self.type)
+
+
 class EntryRelatedObject(models.Model):
     entry = models.ForeignKey('Entry', related_name='targets')
     relation_name = models.CharField(max_length=100)
@@ -176,6 +278,44 @@ class EntryRelatedObject(models.Model):
     related_object = generic.GenericForeignKey('related_content_type', 'related_id')
 
 
+def resolve_targets(pairs):
+    '''
+    Resolve an iterable of (content_type_id, related_id) pairs to objects with
+    one query per content type.  Returns a dict mapping each pair to its object;
+    pairs referencing deleted objects are omitted.
+    '''
+    ids_by_type = {}
+    for content_type_id, related_id in pairs:
+        ids_by_type.setdefault(content_type_id, set()).add(related_id)
+
+    resolved = {}
+    for content_type_id, ids in ids_by_type.items():
+        model = ContentType.objects.get_for_id(content_type_id).model_class()
+        if model is None:
+            continue
+        for pk, obj in model._default_manager.in_bulk(list(ids)).items():
+            resolved[(content_type_id, pk)] = obj
+    return resolved
+
+
+def prefetch_targets(entries):
+    '''
+    Load the targets and related objects of a list of entries in bulk, so that
+    `targets_map` and `related_object` don't query per entry.
+    '''
+    entries = list(entries)
+    prefetch_related_objects(entries, ['targets'])
+    targets = [t for entry in entries for t in entry.targets.all()]
+    resolved = resolve_targets(
+        (t.related_content_type_id, t.related_id) for t in targets)
+
+    cache_attr = EntryRelatedObject.related_object.cache_attr
+    for target in targets:
+        setattr(target, cache_attr, resolved.get(
+            (target.related_content_type_id, target.related_id)))
+    return entries
+
+
 def replace_object_in_papertrail(old_obj, new_obj, entry_qs=None):
     entry_qs = entry_qs or Entry.objects.all()
     old_obj_type = ContentType.objects.get_for_model(old_obj.__class__)
@@ -187,6 +327,7 @@ def replace_object_in_papertrail(old_obj, new_obj, entry_qs=None):
         ))
     related_qs.update(related_content_type=new_obj_type,
                       related_id=new_obj.pk)
+    cache.invalidate(old_obj, new_obj)
 
 
 def search(*args, **kwargs):
@@ -211,39 +352,148 @@ def search(*args, **kwargs):
     return qs
 
 
-def log(event_type, message, data=None, timestamp=None, targets=None, external_key=None):
-    try:
-        timestamp = timestamp or timezone.now()
-        with transaction.commit_on_success():
-
-            # Enforce uniqueness on event_type/external_id if an external id is
-            # provided
-            if external_key:
-                entry, created = Entry.objects.get_or_create(
-                    type=event_type,
-                    external_key=external_key,
-                    defaults={
-                        'message': message,
-                        'data': data,
-                        'timestamp': timestamp,
-                        })
-                if not created:
-                    return
-            else:
-                entry = Entry.objects.create(
-                        type=event_type,
-                        message=message,
-                        data=data,
-                        timestamp=timestamp or timezone.now()
-                        )
-
-            entry.update(targets)
-            if getattr(settings, 'PAPERTRAIL_SHOW', False):
-                WARNING = u'\033[95m'
-                ENDC = u'\033[0m'
-                print WARNING + u'papertrail ' + ENDC + event_type + u" " + message
-    except:
-        raise
+def _supports_insert_or_ignore(connection):
+    if connection.vendor == 'sqlite':
+        # ON CONFLICT ... DO NOTHING needs SQLite 3.24
+        import sqlite3
+        return sqlite3.sqlite_version_info >= (3, 24)
+    if connection.vendor == 'postgresql':
+        # ON CONFLICT ... DO NOTHING needs PostgreSQL 9.5, and the server
+        # version is only known once connected
+        connection.cursor()
+        return connection.pg_version >= 90500
+    return connection.vendor == 'mysql'
+
+
+def insert_entry_or_ignore(event_type, message, data=None, timestamp=None,
+                           external_key=None, using=None):
+    '''
+    Insert an entry in a single statement, silently skipping it if an entry
+    with the same type and external_key already exists.  Relies on the unique
+    constraint over (type, external_key), so concurrent writers never
+    double-insert and don't need to retry.  A writer inserting a key that
+    another, uncommitted transaction has just inserted waits for that
+    transaction to finish before skipping the entry.  Only that conflict is
+    ignored; other errors are raised as usual.
+
+    Returns a tuple of (entry, created).  If the entry already existed, entry
+    is None: the existing row is not fetched.  Targets are not touched, which
+    makes this usable as a building block for bulk loaders as well as `log()`.
+
+    `post_save` is sent for created entries, but `pre_save` is not, since the
+    row is written without going through `Entry.save()`.
+    '''
+    using = using or router.db_for_write(Entry)
+    connection = connections[using]
+    timestamp = timestamp or timezone.now()
+    values = {
+        'timestamp': timestamp,
+        'type': event_type,
+        'message': message,
+        'data': data,
+        'external_key': external_key,
+        }
+    entry = Entry(**values)
+
+    if not _supports_insert_or_ignore(connection):
+        # Fall back to catching the constraint violation on other backends
+        sid = transaction.savepoint(using=using)
+        try:
+            entry.save(force_insert=True, using=using)
+        except IntegrityError:
+            transaction.savepoint_rollback(sid, using=using)
+            return None, False
+        transaction.savepoint_commit(sid, using=using)
+        return entry, True
+
+    qn = connection.ops.quote_name
+    columns = ['timestamp', 'type', 'message', 'data', 'external_key']
+    params = [Entry._meta.get_field(c).get_db_prep_save(values[c], connection=connection)
+              for c in columns]
+    sql = 'INSERT INTO {table} ({columns}) VALUES ({values})'.format(
+        table=qn(Entry._meta.db_table),
+        columns=', '.join(qn(c) for c in columns),
+        values=', '.join(['%s'] * len(columns)),
+        )
+    if connection.vendor == 'mysql':
+        # Unlike INSERT IGNORE, this doesn't also swallow truncation and
+        # NOT NULL errors.  No row is inserted on a duplicate key, so the
+        # last insert id is 0.
+        sql += ' ON DUPLICATE KEY UPDATE {0} = {0}'.format(qn('id'))
+    else:
+        sql += ' ON CONFLICT ({0}, {1}) DO NOTHING'.format(
+            qn('type'), qn('external_key'))
+    if connection.vendor == 'postgresql':
+        sql += ' RETURNING {0}'.format(qn('id'))
+
+    cursor = connection.cursor()
+    cursor.execute(sql, params)
+    if connection.vendor == 'postgresql':
+        row = cursor.fetchone()
+        pk = row[0] if row else None
+    elif connection.vendor == 'mysql':
+        pk = cursor.lastrowid or None
     else:
-        signals.event_logged.send_robust(sender=entry)
-        return entry
+        pk = cursor.lastrowid if cursor.rowcount == 1 else None
+    transaction.commit_unless_managed(using=using)
+
+    if pk is None:
+        return None, False
+    entry.pk = pk
+    entry._state.adding = False
+    entry._state.db = using
+    models.signals.post_save.send(sender=Entry, instance=entry, created=True,
+                                  update_fields=None, raw=False, using=using)
+    return entry, True
+
+
+def _create_entry(event_type, message, data=None, timestamp=None, targets=None,
+                  external_key=None):
+    '''
+    Create an entry and its targets in the current transaction.  Returns None
+    if an entry with the same event type and external_key already exists.
+    '''
+    timestamp = timestamp or timezone.now()
+
+    # Enforce uniqueness on event_type/external_id if an external id is
+    # provided
+    if external_key:
+        entry, created = insert_entry_or_ignore(
+            event_type, message,
+            data=data,
+            timestamp=timestamp,
+            external_key=external_key,
+            )
+        if not created:
+            return
+    else:
+        entry = Entry.objects.create(
+                type=event_type,
+                message=message,
+                data=data,
+                timestamp=timestamp
+                )
+
+    entry.update(targets)
+    if getattr(settings, 'PAPERTRAIL_SHOW', False):
+        WARNING = u'\033[95m'
+        ENDC = u'\033[0m'
+        print WARNING + u'papertrail ' + ENDC + event_type + u" " + message
+    return entry
+
+
+def _entry_logged(entry, targets):
+    # Targets were already invalidated as they were set, but a reader may
+    # have repopulated the cache before the transaction committed.
+    cache.invalidate(*(targets or {}).values())
+    signals.event_logged.send_robust(sender=entry)
+
+
+def log(event_type, message, data=None, timestamp=None, targets=None, external_key=None):
+    with transaction.commit_on_success():
+        entry = _create_entry(event_type, message, data=data,
+                              timestamp=timestamp, targets=targets,
+                              external_key=external_key)
+    if entry is not None:
+        _entry_logged(entry, targets)
+    return entry
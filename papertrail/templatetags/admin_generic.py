@@ -1,9 +1,106 @@
+import threading
+
 from django import template
+from django.conf import settings
 from django.db import models
-from django.core.urlresolvers import reverse, NoReverseMatch
+from django.core.urlresolvers import (reverse, NoReverseMatch, get_resolver,
+                                      get_script_prefix, get_urlconf)
+from django.utils.encoding import force_unicode
+from django.utils.http import urlquote
+from django.test.signals import setting_changed
 
 register = template.Library()
 
+# Placeholder primary key substituted into reversed admin URLs to build a
+# per-view format template.
+PK_PLACEHOLDER = '__papertrail_pk__'
+
+# Cached in place of a template for views whose URL pattern doesn't accept
+# the placeholder
+PER_INSTANCE = object()
+
+# Characters reverse() leaves unescaped when quoting URL arguments
+URL_SAFE_CHARS = "!$&'()*+,;=/~:@"
+
+_admin_url_templates = {}
+_admin_url_templates_lock = threading.Lock()
+
+
+def clear_admin_url_cache(**kwargs):
+    with _admin_url_templates_lock:
+        _admin_url_templates.clear()
+
+
+def _on_setting_changed(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        clear_admin_url_cache()
+
+setting_changed.connect(_on_setting_changed)
+
+
+def _admin_view_name(app_label, module_name, view):
+    return 'admin:{app}_{module}_{view}'.format(
+        app=app_label,
+        module=module_name,
+        view=view
+        )
+
+
+def _admin_url_template(app_label, module_name, view):
+    '''
+    Resolve the admin URL for `view` of a model once, returning a template
+    with `PK_PLACEHOLDER` standing in for the object's primary key.  Returns
+    None if the view doesn't exist, or `PER_INSTANCE` if its URL pattern
+    doesn't accept the placeholder (e.g. it only matches digits) and has to
+    be reversed for each object.  Results are cached per URLconf and script
+    prefix, since reverse() includes the current thread's prefix.
+    '''
+    key = (get_urlconf(settings.ROOT_URLCONF), get_script_prefix(),
+           app_label, module_name, view)
+    try:
+        return _admin_url_templates[key]
+    except KeyError:
+        pass
+
+    view_name = _admin_view_name(app_label, module_name, view)
+    try:
+        url_template = reverse(view_name, args=[PK_PLACEHOLDER])
+    except NoReverseMatch:
+        url_template = PER_INSTANCE if _view_exists(view_name) else None
+
+    with _admin_url_templates_lock:
+        _admin_url_templates[key] = url_template
+    return url_template
+
+
+def _view_exists(view_name):
+    '''
+    Check whether a namespaced view name is known to the URLconf, regardless
+    of the arguments its pattern accepts.
+    '''
+    namespace, name = view_name.split(':', 1)
+    resolver = get_resolver(get_urlconf())
+    try:
+        prefix, namespace_resolver = resolver.namespace_dict[namespace]
+    except KeyError:
+        return False
+    return name in namespace_resolver.reverse_dict
+
+
+def _admin_url(app_label, module_name, view, pk):
+    url_template = _admin_url_template(app_label, module_name, view)
+    if url_template is None:
+        return None
+    if url_template is PER_INSTANCE:
+        try:
+            return reverse(_admin_view_name(app_label, module_name, view),
+                           args=[pk])
+        except NoReverseMatch:
+            return None
+    return url_template.replace(
+        PK_PLACEHOLDER, urlquote(force_unicode(pk), safe=URL_SAFE_CHARS))
+
+
 @register.filter
 def adminview(value, view='change'):
     '''
@@ -13,21 +110,48 @@ def adminview(value, view='change'):
         {{ user|adminview:'history' }} -> /admin/user/{user_id}/history/
     '''
     if isinstance(value, models.Model):
-        try:
-            change_form_url = reverse(
-                'admin:{app}_{module}_{view}'.format(
-                    app=value._meta.app_label,
-                    module=value._meta.module_name,
-                    view=view
-                    ),
-                args=[value.pk]
-            )
-            return change_form_url
-        except NoReverseMatch:
-            pass
+        return _admin_url(value._meta.app_label, value._meta.module_name,
+                          view, value.pk)
     return None
 
+
 @register.filter
 def has_papertrail(model_instance):
-    url = adminview(model_instance, 'papertrail')
-    return url is not None
+    if isinstance(model_instance, models.Model):
+        opts = model_instance._meta
+        url_template = _admin_url_template(opts.app_label, opts.module_name,
+                                           'papertrail')
+        if url_template is PER_INSTANCE:
+            return adminview(model_instance, 'papertrail') is not None
+        return url_template is not None
+    return False
+
+
+@register.assignment_tag
+def adminviews(objects, view='change'):
+    '''
+    Resolve admin links for a list of objects, returning a list of (object,
+    url) pairs.  `objects` may contain model instances or entry targets
+    (`EntryRelatedObject`s), which are linked to their related object.
+    Targets of deleted objects get no url.
+
+    Targets should have their related objects loaded in bulk beforehand (see
+    `papertrail.models.prefetch_targets()`), otherwise each one is fetched
+    separately.
+
+    Example:
+        {% adminviews action.targets.all 'change' as target_links %}
+        {% for target, url in target_links %}
+            <a href="{{ url }}">{{ target.relation_name }}</a>
+        {% endfor %}
+    '''
+    from papertrail.models import EntryRelatedObject
+
+    links = []
+    for obj in objects:
+        if isinstance(obj, EntryRelatedObject):
+            url = adminview(obj.related_object, view)
+        else:
+            url = adminview(obj, view)
+        links.append((obj, url))
+    return links
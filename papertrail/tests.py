@@ -1,10 +1,52 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.conf.urls import patterns, include, url
+from django.contrib import admin
+from django.contrib.admin.models import LogEntry, ADDITION, CHANGE
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.urlresolvers import set_script_prefix
+from django.db import connection
+from django.db.models import Max
+from django.db.models.signals import post_save
 from django.dispatch import receiver
-from django.test import TestCase
+from django.template import Context, Template
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import override_settings
 from django.utils import timezone
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes.models import ContentType
-from papertrail.models import Entry, related_to, log, replace_object_in_papertrail
-from papertrail import signals
+from papertrail.models import (Entry, related_to, log, replace_object_in_papertrail,
+                               insert_entry_or_ignore, prefetch_targets)
+from papertrail import cache, executor, live, signals
+from papertrail.templatetags import admin_generic
+
+
+class GroupPapertrailAdmin(admin.ModelAdmin):
+
+    def get_urls(self):
+        # A papertrail view whose pattern only accepts digits
+        return patterns('',
+            url(r'^(\d+)/papertrail/$', lambda request, object_id: None,
+                name='auth_group_papertrail'),
+        ) + super(GroupPapertrailAdmin, self).get_urls()
+
+test_admin_site = admin.AdminSite(name='admin')
+test_admin_site.register(User)
+test_admin_site.register(Group, GroupPapertrailAdmin)
+
+urlpatterns = patterns('',
+    url(r'^admin/', include(test_admin_site.urls)),
+    url(r'^papertrail/', include('papertrail.urls')),
+)
 
 
 class TestBasic(TestCase):
@@ -119,3 +161,525 @@ class TestBasic(TestCase):
         qs = Entry.objects.all()
         self.assertEqual(qs.related_to(user1).count(), 0)
         self.assertEqual(qs.related_to(user2).count(), 2)
+
+
+class TestTimelineCache(TestCase):
+
+    def setUp(self):
+        cache.clear_local()
+        cache.stats.reset()
+
+    def test_read_through(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        log('test-entry', 'First entry', targets={'user': user})
+
+        self.assertEqual(len(cache.timeline(user)), 1)
+        self.assertEqual(cache.stats.misses, 1)
+        self.assertEqual(len(cache.timeline(user)), 1)
+        self.assertEqual(cache.stats.local_hits, 1)
+
+        # A fresh process still hits the shared cache
+        cache.clear_local()
+        self.assertEqual(len(cache.timeline(user)), 1)
+        self.assertEqual(cache.stats.shared_hits, 1)
+        self.assertEqual(cache.stats.misses, 1)
+
+    def test_invalidation_on_write(self):
+        user1 = User.objects.create_user('testuser1', 'test1@example.com')
+        user2 = User.objects.create_user('testuser2', 'test2@example.com')
+        group = Group.objects.create(name='Test Group')
+
+        log('test-entry', 'First entry', targets={'user': user1})
+        self.assertEqual(cache.type_counts(user1), {'test-entry': 1})
+        self.assertEqual(cache.type_counts(group), {})
+
+        # log()
+        e = log('test-other', 'Second entry', targets={'user': user1})
+        self.assertEqual(cache.type_counts(user1),
+                         {'test-entry': 1, 'test-other': 1})
+
+        # Entry.set() invalidates both the old and the new target
+        e.set('user', group)
+        self.assertEqual(cache.type_counts(user1), {'test-entry': 1})
+        self.assertEqual(cache.type_counts(group), {'test-other': 1})
+
+        # replace_object_in_papertrail()
+        self.assertEqual(cache.type_counts(user2), {})
+        replace_object_in_papertrail(user1, user2)
+        self.assertEqual(cache.type_counts(user1), {})
+        self.assertEqual(cache.type_counts(user2), {'test-entry': 1})
+
+    def test_dummy_cache(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        shared_cache = cache.cache
+        cache.cache = get_cache('django.core.cache.backends.dummy.DummyCache')
+        try:
+            log('test-entry', 'First entry', targets={'user': user})
+            self.assertEqual(cache.type_counts(user), {'test-entry': 1})
+            log('test-entry', 'Second entry', targets={'user': user})
+            self.assertEqual(cache.type_counts(user), {'test-entry': 2})
+            self.assertEqual(cache.stats.local_hits, 0)
+            self.assertEqual(cache.stats.misses, 2)
+        finally:
+            cache.cache = shared_cache
+
+
+# In-memory SQLite test databases can't be seen from other connections
+SHARED_TEST_DATABASE = not (
+    connection.vendor == 'sqlite' and
+    connection.settings_dict.get('TEST_NAME') in (None, '', ':memory:'))
+
+
+def _log_keys_in_process(keys, results):
+    # Each process needs its own database connection
+    connection.close()
+    created = 0
+    for key in keys:
+        if log('test-stress', 'Stress test entry', external_key=key):
+            created += 1
+    connection.close()
+    results.put(created)
+
+
+class TestExternalKey(TestCase):
+
+    def test_dedup(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        e = log('test-entry', 'First', external_key='key1', targets={'user': user})
+        self.assertTrue(e is not None)
+        self.assertEqual(e['user'], user)
+
+        self.assertEqual(log('test-entry', 'Second', external_key='key1'), None)
+        self.assertEqual(Entry.objects.filter(external_key='key1').count(), 1)
+        self.assertEqual(Entry.objects.get(external_key='key1').message, 'First')
+
+        # Keys are only unique per event type
+        self.assertTrue(log('test-other', 'Third', external_key='key1') is not None)
+
+    def test_insert_entry_or_ignore(self):
+        entry, created = insert_entry_or_ignore('test-entry', 'First',
+                                                data={'key': 'value'},
+                                                external_key='key1')
+        self.assertTrue(created)
+        self.assertEqual(Entry.objects.get(pk=entry.pk).data, {'key': 'value'})
+
+        entry, created = insert_entry_or_ignore('test-entry', 'First',
+                                                external_key='key1')
+        self.assertFalse(created)
+        self.assertEqual(entry, None)
+
+    @unittest.skipUnless(connection.vendor == 'postgresql', 'Requires PostgreSQL')
+    def test_insert_entry_or_ignore_before_postgresql_95(self):
+        connection.cursor()
+        pg_version = connection._pg_version
+        # Servers without ON CONFLICT fall back to catching the IntegrityError
+        connection._pg_version = 90400
+        try:
+            entry, created = insert_entry_or_ignore('test-entry', 'First',
+                                                    external_key='key1')
+            self.assertTrue(created)
+            entry, created = insert_entry_or_ignore('test-entry', 'First',
+                                                    external_key='key1')
+            self.assertFalse(created)
+        finally:
+            connection._pg_version = pg_version
+        self.assertEqual(Entry.objects.filter(external_key='key1').count(), 1)
+
+    def test_insert_entry_or_ignore_sends_post_save(self):
+        saved = []
+
+        @receiver(post_save, sender=Entry)
+        def on_post_save(sender, instance, created, **kwargs):
+            saved.append((instance.pk, created))
+
+        entry, created = insert_entry_or_ignore('test-entry', 'First',
+                                                external_key='key1')
+        insert_entry_or_ignore('test-entry', 'First', external_key='key1')
+        self.assertEqual(saved, [(entry.pk, True)])
+        post_save.disconnect(on_post_save, sender=Entry)
+
+
+class PapertrailTransactionTestCase(TransactionTestCase):
+
+    # Flushing the database recreates content types, so ids cached before the
+    # flush would be stale
+
+    def _fixture_setup(self):
+        ContentType.objects.clear_cache()
+        super(PapertrailTransactionTestCase, self)._fixture_setup()
+
+    def _fixture_teardown(self):
+        ContentType.objects.clear_cache()
+        super(PapertrailTransactionTestCase, self)._fixture_teardown()
+
+
+class TestExternalKeyConcurrency(PapertrailTransactionTestCase):
+
+    @unittest.skipUnless(SHARED_TEST_DATABASE,
+                         'Requires a test database shared between processes')
+    def test_concurrent_dedup(self):
+        keys = ['key{0}'.format(i) for i in range(50)]
+        results = multiprocessing.Queue()
+        connection.close()
+        processes = [multiprocessing.Process(target=_log_keys_in_process,
+                                             args=(keys, results))
+                     for _ in range(4)]
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+
+        created = sum(results.get() for _ in processes)
+        self.assertEqual(created, len(keys))
+        self.assertEqual(Entry.objects.filter(type='test-stress').count(), len(keys))
+
+
+class TestAdminBackfill(TestCase):
+
+    def test_backfill(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        group = Group.objects.create(name='Test Group')
+        group_type = ContentType.objects.get_for_model(Group)
+        LogEntry.objects.log_action(user.pk, group_type.pk, group.pk,
+                                    unicode(group), ADDITION)
+        LogEntry.objects.log_action(user.pk, group_type.pk, group.pk,
+                                    unicode(group), CHANGE,
+                                    'Changed name and permissions.')
+
+        call_command('papertrail_backfill_admin', processes=1, stdout=StringIO())
+
+        qs = Entry.objects.filter(type='admin-edit')
+        self.assertEqual(qs.count(), 2)
+        self.assertEqual(qs.related_to(acting_user=user, instance=group).count(), 2)
+        changed = qs.get(message='Updated object')
+        self.assertEqual(changed.data['fields'], ['name', 'permissions'])
+
+        # Running again doesn't duplicate entries
+        call_command('papertrail_backfill_admin', processes=1, stdout=StringIO())
+        self.assertEqual(qs.count(), 2)
+
+    def test_backfill_stops_at_mixin_entries(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        group = Group.objects.create(name='Test Group')
+        group_type = ContentType.objects.get_for_model(Group)
+        LogEntry.objects.log_action(user.pk, group_type.pk, group.pk,
+                                    unicode(group), ADDITION)
+        LogEntry.objects.update(action_time=timezone.now() - timedelta(hours=1))
+
+        # Edits from here on are logged by AdminEventLoggerMixin, which writes
+        # both a LogEntry and an admin-edit entry
+        LogEntry.objects.log_action(user.pk, group_type.pk, group.pk,
+                                    unicode(group), CHANGE, '{}')
+        log('admin-edit', 'Updated object', targets={'acting_user': user,
+                                                     'instance': group})
+
+        call_command('papertrail_backfill_admin', processes=1, stdout=StringIO())
+        qs = Entry.objects.filter(type='admin-edit')
+        self.assertEqual(qs.count(), 2)
+        self.assertEqual(qs.filter(message='Created object').count(), 1)
+
+        call_command('papertrail_backfill_admin', processes=1, all=True,
+                     stdout=StringIO())
+        self.assertEqual(qs.count(), 3)
+
+
+@unittest.skipUnless(SHARED_TEST_DATABASE,
+                     'Requires a test database shared between processes')
+class TestAdminBackfillProcesses(PapertrailTransactionTestCase):
+
+    def setUp(self):
+        fd, self.checkpoint = tempfile.mkstemp()
+        os.close(fd)
+        os.remove(self.checkpoint)
+
+    def tearDown(self):
+        if os.path.exists(self.checkpoint):
+            os.remove(self.checkpoint)
+
+    def test_checkpoint_resume(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        group = Group.objects.create(name='Test Group')
+        group_type = ContentType.objects.get_for_model(Group)
+
+        def log_actions(count):
+            for _ in range(count):
+                LogEntry.objects.log_action(user.pk, group_type.pk, group.pk,
+                                            unicode(group), CHANGE,
+                                            'Changed name.')
+
+        log_actions(5)
+        call_command('papertrail_backfill_admin', processes=2, batch_size=2,
+                     checkpoint=self.checkpoint, stdout=StringIO())
+        qs = Entry.objects.filter(type='admin-edit')
+        self.assertEqual(qs.count(), 5)
+        last_id = LogEntry.objects.aggregate(last=Max('id'))['last']
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f), {'last_id': last_id})
+
+        # Entries before the checkpoint aren't converted again, even if they
+        # have since been removed
+        qs.order_by('id')[0].delete()
+        log_actions(3)
+        call_command('papertrail_backfill_admin', processes=2, batch_size=2,
+                     checkpoint=self.checkpoint, stdout=StringIO())
+        self.assertEqual(qs.count(), 7)
+        with open(self.checkpoint) as f:
+            self.assertEqual(json.load(f)['last_id'],
+                             LogEntry.objects.aggregate(last=Max('id'))['last'])
+
+
+class TestTail(TestCase):
+    urls = 'papertrail.tests'
+
+    def test_tail(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        log('test-entry', 'Before tailing')
+        cursor = live.current_cursor()
+
+        self.assertEqual(list(live.tail(cursor, timeout=0)), [])
+
+        log('test-entry', 'First', targets={'user': user})
+        log('test-other', 'Second')
+        entries = list(live.tail(cursor, timeout=0))
+        self.assertEqual([e.message for e in entries], ['First', 'Second'])
+        with self.assertNumQueries(0):
+            self.assertEqual(entries[0].targets_map, {'user': user})
+
+        entries = list(live.tail(cursor, filters={'type': 'test-other'}, timeout=0))
+        self.assertEqual([e.message for e in entries], ['Second'])
+
+    def test_tail_view(self):
+        staff = User.objects.create_user('staff', 'staff@example.com', 'password')
+        staff.is_staff = True
+        staff.save()
+        self.client.login(username='staff', password='password')
+
+        log('test-entry', 'Before tailing')
+        response = self.client.get('/papertrail/tail/')
+        self.assertEqual(response.status_code, 200)
+        cursor = json.loads(response.content)['cursor']
+        self.assertEqual(cursor, live.current_cursor())
+
+        log('test-entry', 'First', targets={'user': staff})
+        log('test-other', 'Second')
+        response = self.client.get('/papertrail/tail/',
+                                   {'cursor': cursor, 'type': 'test-entry'})
+        result = json.loads(response.content)
+        self.assertEqual([e['message'] for e in result['entries']], ['First'])
+        self.assertEqual(result['entries'][0]['targets']['user']['id'], staff.pk)
+        self.assertEqual(result['cursor'], result['entries'][0]['id'])
+
+        # Nothing new arrives before the timeout
+        response = self.client.get('/papertrail/tail/',
+                                   {'cursor': live.current_cursor(), 'timeout': 0})
+        result = json.loads(response.content)
+        self.assertEqual(result['entries'], [])
+
+        for params in ({'cursor': cursor, 'limit': -5},
+                       {'cursor': cursor, 'limit': 0},
+                       {'cursor': cursor, 'timeout': -1},
+                       {'cursor': cursor, 'timeout': 'nan'},
+                       {'cursor': cursor, 'timeout': 'inf'},
+                       {'cursor': 'abc'}):
+            response = self.client.get('/papertrail/tail/', params)
+            self.assertEqual(response.status_code, 400)
+
+
+@unittest.skipUnless(SHARED_TEST_DATABASE,
+                     'Requires a test database shared between threads')
+class TestTailWakeup(PapertrailTransactionTestCase):
+
+    def test_wait_is_woken_by_logging(self):
+        cursor = live.current_cursor()
+
+        def log_from_thread():
+            log('test-entry', 'Wake up')
+            connection.close()
+
+        # With a long poll interval, only event_logged can wake the wait early
+        timer = threading.Timer(0.2, log_from_thread)
+        started = time.time()
+        timer.start()
+        entries = live.wait_for_new_entries(cursor, timeout=10, poll_interval=10)
+        timer.join()
+        self.assertEqual([e.message for e in entries], ['Wake up'])
+        self.assertTrue(time.time() - started < 5)
+
+
+class TestEntryRows(TestCase):
+
+    def test_as_rows(self):
+        user = User.objects.create_user('testuser', 'test@example.com')
+        group = Group.objects.create(name='Test Group')
+        log('test-entry', 'First', targets={'user': user, 'group': group})
+        log('test-entry', 'Second', data={'key': 'value'})
+
+        qs = Entry.objects.filter(type='test-entry').order_by('id')
+        rows = list(qs.as_rows(chunk_size=1))
+        self.assertEqual([r.message for r in rows], ['First', 'Second'])
+        self.assertEqual(rows[1].data, None)
+        self.assertEqual(rows[1].targets, ())
+
+        user_type = ContentType.objects.get_for_model(User)
+        self.assertTrue(('user', user_type.pk, user.pk) in rows[0].targets)
+        self.assertEqual(rows[0].targets_map, {'user': user, 'group': group})
+
+        rows = list(qs.as_rows(data=True, resolve=True))
+        self.assertEqual(rows[1].data, u'{"key": "value"}')
+        with self.assertNumQueries(0):
+            self.assertEqual(rows[0].targets_map, {'user': user, 'group': group})
+
+        with self.assertRaises(AttributeError):
+            rows[0].message = 'Changed'
+
+    def test_as_rows_chunk_size(self):
+        qs = Entry.objects.all()
+        self.assertRaises(ValueError, qs.as_rows, chunk_size=0)
+        self.assertRaises(ValueError, qs.as_rows, chunk_size=-1)
+
+
+@unittest.skipUnless(SHARED_TEST_DATABASE,
+                     'Requires a test database shared between threads')
+@unittest.skipIf(executor.ThreadPoolExecutor is None,
+                 'Requires concurrent.futures')
+class TestExecutor(PapertrailTransactionTestCase):
+
+    def tearDown(self):
+        executor.shutdown()
+
+    def test_log_and_search_async(self):
+        event_logged_counter = [0]
+
+        @receiver(signals.event_logged)
+        def on_event_logged(sender, **kwargs):
+            event_logged_counter[0] += 1
+
+        user = User.objects.create_user('testuser', 'test@example.com')
+        entry = executor.log_async('test-entry', 'First', external_key='key1',
+                                   targets={'user': user}).result()
+        self.assertEqual(entry.message, 'First')
+        self.assertEqual(event_logged_counter[0], 1)
+
+        # External key deduplication still applies
+        self.assertEqual(executor.log_async('test-entry', 'Again',
+                                            external_key='key1').result(), None)
+
+        entries = executor.log_many_async([
+            {'args': ('test-entry', 'Second')},
+            {'args': ('test-entry', 'Third'), 'kwargs': {'targets': {'user': user}}},
+            ]).result()
+        self.assertEqual([e.message for e in entries], ['Second', 'Third'])
+
+        # A failing event rolls back the whole batch
+        future = executor.log_many_async([
+            {'args': ('test-batch', 'Fourth')},
+            {'args': ('test-batch', 'Fifth'), 'kwargs': {'data': {'bad': object()}}},
+            ])
+        self.assertRaises(TypeError, future.result)
+        self.assertEqual(Entry.objects.filter(type='test-batch').count(), 0)
+        self.assertEqual(event_logged_counter[0], 3)
+
+        self.assertEqual(len(executor.search_async(user).result()), 2)
+
+    def test_worker_connections_are_reused(self):
+        def connection_id():
+            connection.cursor()
+            return id(connection.connection)
+
+        with override_settings(PAPERTRAIL_EXECUTOR_WORKERS=1):
+            executor.shutdown()
+            first = executor.submit(connection_id).result()
+            self.assertEqual(executor.submit(connection_id).result(), first)
+
+    def test_full_executor_fails_fast(self):
+        release = threading.Event()
+        with override_settings(PAPERTRAIL_EXECUTOR_WORKERS=1,
+                               PAPERTRAIL_EXECUTOR_MAX_PENDING=1):
+            executor.shutdown()
+            future = executor.submit(release.wait)
+            with self.assertRaises(executor.ExecutorFull):
+                executor.submit(release.wait)
+            release.set()
+            future.result()
+
+    def test_benchmark(self):
+        out = StringIO()
+        call_command('papertrail_benchmark_log', entries=20, batch_size=5,
+                     external_keys=True, stdout=out)
+        self.assertEqual(
+            [line.split()[0] for line in out.getvalue().splitlines()],
+            ['log', 'log_async', 'log_many_async'])
+        self.assertEqual(Entry.objects.count(), 0)
+
+
+class TestAdminLinks(TestCase):
+    urls = 'papertrail.tests'
+
+    def setUp(self):
+        admin_generic.clear_admin_url_cache()
+        self.user = User.objects.create_user('testuser', 'test@example.com')
+        self.group = Group.objects.create(name='Test Group')
+
+    def test_substitution(self):
+        self.assertEqual(admin_generic.adminview(self.user),
+                         '/admin/auth/user/{0}/'.format(self.user.pk))
+        self.assertEqual(admin_generic.adminview(self.user, 'history'),
+                         '/admin/auth/user/{0}/history/'.format(self.user.pk))
+
+        # Later objects are linked from the cached template
+        user2 = User.objects.create_user('testuser2', 'test2@example.com')
+        self.assertEqual(admin_generic.adminview(user2),
+                         '/admin/auth/user/{0}/'.format(user2.pk))
+        self.assertEqual(len(admin_generic._admin_url_templates), 2)
+
+    def test_script_prefix(self):
+        self.assertEqual(admin_generic.adminview(self.user),
+                         '/admin/auth/user/{0}/'.format(self.user.pk))
+        set_script_prefix('/app/')
+        try:
+            self.assertEqual(admin_generic.adminview(self.user),
+                             '/app/admin/auth/user/{0}/'.format(self.user.pk))
+        finally:
+            set_script_prefix('/')
+        self.assertEqual(admin_generic.adminview(self.user),
+                         '/admin/auth/user/{0}/'.format(self.user.pk))
+
+    def test_missing_view(self):
+        self.assertEqual(admin_generic.adminview(self.user, 'papertrail'), None)
+        self.assertFalse(admin_generic.has_papertrail(self.user))
+        self.assertEqual(admin_generic.adminview(None), None)
+        self.assertFalse(admin_generic.has_papertrail(None))
+
+    def test_digit_only_pattern(self):
+        self.assertTrue(admin_generic.has_papertrail(self.group))
+        self.assertEqual(admin_generic.adminview(self.group, 'papertrail'),
+                         '/admin/auth/group/{0}/papertrail/'.format(self.group.pk))
+
+    def test_cache_cleared_on_urlconf_change(self):
+        admin_generic.adminview(self.user)
+        self.assertTrue(admin_generic._admin_url_templates)
+        with override_settings(ROOT_URLCONF='papertrail.urls'):
+            self.assertEqual(admin_generic._admin_url_templates, {})
+
+    def test_adminviews_tag(self):
+        e = log('test-entry', 'Test Entry',
+                targets={'user': self.user, 'group': self.group})
+        e.set('deleted', (ContentType.objects.get_for_model(User), 10000))
+
+        template = Template(
+            "{% load admin_generic %}"
+            "{% adminviews targets 'change' as links %}"
+            "{% for target, url in links %}"
+            "{{ target.relation_name }}={{ url|default:'' }};"
+            "{% endfor %}")
+        targets = e.targets.order_by('relation_name')
+        self.assertEqual(
+            template.render(Context({'targets': targets})),
+            'deleted=;group=/admin/auth/group/{0}/;user=/admin/auth/user/{1}/;'.format(
+                self.group.pk, self.user.pk))
+
+        # With targets loaded in bulk, rendering doesn't query
+        entry = prefetch_targets(Entry.objects.filter(pk=e.pk))[0]
+        with self.assertNumQueries(0):
+            rendered = template.render(Context({'targets': entry.targets.all()}))
+        self.assertEqual(len(rendered.split(';')), 4)
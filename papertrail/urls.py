@@ -0,0 +1,5 @@
+from django.conf.urls import patterns, url
+
+urlpatterns = patterns('papertrail.views',
+    url(r'^tail/$', 'tail_entries', name='papertrail_tail'),
+)
@@ -0,0 +1,81 @@
+import json
+import math
+
+from django.contrib.admin.views.decorators import staff_member_required
+from django.contrib.contenttypes.models import ContentType
+from django.http import HttpResponse, HttpResponseBadRequest
+from django.utils.encoding import force_unicode
+
+from papertrail import live
+
+# Longest time a long-poll request is held open, in seconds
+MAX_TAIL_TIMEOUT = 60
+
+# How often to check for entries logged by other processes, in seconds
+TAIL_POLL_INTERVAL = 5
+
+
+def _entry_to_json(entry):
+    targets = {}
+    for target in entry.targets.all():
+        content_type = ContentType.objects.get_for_id(target.related_content_type_id)
+        obj = target.related_object
+        targets[target.relation_name] = {
+            'content_type': '{0}.{1}'.format(content_type.app_label, content_type.model),
+            'id': target.related_id,
+            'repr': force_unicode(obj) if obj is not None else None,
+            }
+    return {
+        'id': entry.id,
+        'timestamp': entry.timestamp.isoformat(),
+        'type': entry.type,
+        'message': entry.message,
+        'data': entry.data,
+        'targets': targets,
+        }
+
+
+@staff_member_required
+def tail_entries(request):
+    '''
+    Long-poll for entries logged after the `cursor` query parameter, waiting
+    up to `timeout` seconds for one to arrive.  Entries can be narrowed with
+    `type` and `type_prefix`.  Without a cursor, returns the current head of
+    the papertrail to start from.
+
+    Responds with JSON: {"cursor": <next cursor>, "entries": [...]}
+    '''
+    try:
+        cursor = request.GET.get('cursor')
+        cursor = int(cursor) if cursor else None
+        timeout = float(request.GET.get('timeout', 25))
+        limit = min(int(request.GET.get('limit', 100)), 1000)
+    except ValueError:
+        return HttpResponseBadRequest('Invalid cursor, timeout or limit')
+    # float() accepts 'nan' and 'inf', which would never time out
+    if (math.isnan(timeout) or math.isinf(timeout) or timeout < 0 or
+            limit < 1):
+        return HttpResponseBadRequest('Invalid cursor, timeout or limit')
+    timeout = min(timeout, MAX_TAIL_TIMEOUT)
+
+    filters = {}
+    if request.GET.get('type'):
+        filters['type'] = request.GET['type']
+    if request.GET.get('type_prefix'):
+        filters['type__startswith'] = request.GET['type_prefix']
+
+    entries = []
+    if cursor is None:
+        cursor = live.current_cursor()
+    else:
+        entries = live.wait_for_new_entries(cursor, filters, limit=limit,
+                                            timeout=timeout,
+                                            poll_interval=TAIL_POLL_INTERVAL)
+        if entries:
+            cursor = entries[-1].id
+
+    body = json.dumps({
+        'cursor': cursor,
+        'entries': [_entry_to_json(e) for e in entries],
+        })
+    return HttpResponse(body, content_type='application/json')
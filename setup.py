@@ -7,5 +7,8 @@ setuptools.setup(
     packages=setuptools.find_packages(),
     install_requires=[
         'django-jsonfield>=0.8.11',
-        ]
+        ],
+    extras_require={
+        'executor': ['futures'],
+        },
 )